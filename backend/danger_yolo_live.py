@@ -19,16 +19,14 @@ from dataclasses import dataclass, field
 from typing import List, Tuple, Dict, Optional, Any
 import csv
 import os
+import queue
+import sys
+import threading
 
 import cv2
 import numpy as np
 from ultralytics import YOLO
 
-try:
-    import joblib
-except ImportError:
-    joblib = None
-
 
 # ------------------------- CONFIG SECTION -------------------------
 
@@ -52,6 +50,13 @@ COCO_CLASSES = {
     # add more if needed
 }
 
+# Classes the tracker/scene logic actually uses
+TRACKED_CLASS_IDS = np.array(
+    [cid for cid, name in COCO_CLASSES.items()
+     if name in ("person", "car", "truck", "bus", "motorbike")],
+    dtype=np.int32,
+)
+
 # Order of features used for ML model (keep in sync with training script)
 FEATURE_KEYS = [
     "after_hours",
@@ -427,35 +432,265 @@ def compute_danger_score(features: dict):
 
 # ------------------------- YOLO WRAPPER ---------------------------
 
+def export_weights(weights, fmt, half=False, device="cpu", batch=1):
+    """
+    Returns the path of an exported copy of `weights`
+    (<stem>.fp16|fp32.b<batch>.engine or .onnx next to the .pt), exporting
+    once if it does not exist yet. Falls back to the original weights when
+    export is off, unsupported or fails.
+
+    Exports have fixed input shapes, so batch > 1 builds a dynamic-batch model
+    (max `batch`): --batch calls predict with up to that many frames, and fewer
+    at end of file or when the motion gate skips some.
+    """
+    batch = max(1, int(batch))
+    if fmt == "none" or not weights.endswith(".pt"):
+        return weights
+    if fmt == "engine" and not str(device).startswith("cuda"):
+        print("[WARN] TensorRT export needs --device cuda; using", weights)
+        return weights
+    # precision + batch in the name so differently-shaped builds never stand in for each other
+    target = f"{os.path.splitext(weights)[0]}.{'fp16' if half else 'fp32'}.b{batch}.{fmt}"
+    if os.path.exists(target):
+        return target
+    try:
+        print(f"[INFO] Exporting {weights} -> {target} (one-time)")
+        out = YOLO(weights).export(
+            format=fmt, half=half, device=device, batch=batch, dynamic=batch > 1
+        )
+        os.replace(out, target)
+        return target
+    except Exception as e:
+        print(f"[WARN] {fmt} export failed ({e}); using {weights}")
+        return weights
+
+
 class Yolo10Detector:
-    def __init__(self, weights="yolov10s.pt", device="cuda"):
-        self.model = YOLO(weights)
+    def __init__(self, weights="yolov10s.pt", device="cuda", half=False, export="none", batch=1):
         self.device = device
+        # FP16 only pays off (and is only supported) on CUDA
+        self.half = bool(half) and str(device).startswith("cuda")
+        self.model = YOLO(export_weights(weights, export, self.half, device, batch))
 
     def detect(self, frame):
         """
         Returns list of {bbox, conf, class_name}
         """
-        results = self.model.predict(frame, device=self.device, verbose=False)[0]
-        detections = []
-        for box in results.boxes:
-            cls_id = int(box.cls)
-            conf = float(box.conf)
-            if cls_id not in COCO_CLASSES:
-                continue
-            class_name = COCO_CLASSES[cls_id]
-            if class_name not in ("person", "car", "truck", "bus", "motorbike"):
-                continue
-
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            detections.append(
-                {
-                    "bbox": (x1, y1, x2, y2),
-                    "conf": conf,
-                    "class_name": class_name,
-                }
-            )
-        return detections
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        """
+        Runs one predict call over all frames (better GPU utilization than
+        batch=1). Returns one detections list per frame, in order.
+        """
+        results = self.model.predict(frames, device=self.device, half=self.half, verbose=False)
+        return [self._parse(r) for r in results]
+
+    @staticmethod
+    def _parse(results):
+        # one device->host copy per tensor instead of a sync per box
+        boxes = results.boxes
+        cls_ids = boxes.cls.cpu().numpy().astype(np.int32)
+        # drop untracked classes in one vectorized pass before touching Python
+        keep = np.isin(cls_ids, TRACKED_CLASS_IDS)
+        cls_ids = cls_ids[keep].tolist()
+        confs = boxes.conf.cpu().numpy()[keep].tolist()
+        xyxy = boxes.xyxy.cpu().numpy()[keep].tolist()
+
+        return [
+            {
+                "bbox": (x1, y1, x2, y2),
+                "conf": conf,
+                "class_name": COCO_CLASSES[cls_id],
+            }
+            for cls_id, conf, (x1, y1, x2, y2) in zip(cls_ids, confs, xyxy)
+        ]
+
+
+# ------------------------- CAPTURE --------------------------------
+
+CAPTURE_BACKENDS = {
+    "auto": cv2.CAP_ANY,
+    "ffmpeg": cv2.CAP_FFMPEG,
+    "gstreamer": cv2.CAP_GSTREAMER,
+}
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Reads a live source on a daemon thread and keeps only the newest frame
+    (1-slot buffer, overwritten on every read). read() mirrors
+    cv2.VideoCapture.read() but returns immediately once a frame newer than
+    the last one handed out exists, so the inference loop never waits on the
+    driver queue or processes stale frames.
+
+    The grabber owns the capture: it is released on this thread when the loop
+    exits, so it is never released while a read() is still in flight.
+    """
+
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._read_seq = 0
+        self._alive = True
+        self._stopped = False
+
+    def run(self):
+        try:
+            while not self._stopped:
+                ok, frame = self.cap.read()
+                if not ok:
+                    break
+                with self._cond:
+                    self._frame = frame
+                    self._seq += 1
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._alive = False
+                self._cond.notify_all()
+            self.cap.release()
+
+    def read(self, should_stop=None):
+        """
+        Waits for a frame newer than the last one returned. A stalled source
+        (RTSP hiccup, webcam warm-up) keeps waiting, but in short slices so
+        stop() or `should_stop()` (e.g. 'q' in the window) still end it even
+        if cap.read() itself hangs. (False, None) means stop or end of stream.
+        """
+        with self._cond:
+            while not self._cond.wait_for(
+                lambda: self._seq != self._read_seq or not self._alive, timeout=0.5
+            ):
+                if self._stopped or (should_stop is not None and should_stop()):
+                    return False, None
+            if self._seq == self._read_seq:
+                return False, None
+            self._read_seq = self._seq
+            return True, self._frame
+
+    def stop(self):
+        self._stopped = True
+        self.join(timeout=1.0)
+
+
+# ------------------------- DISPLAY --------------------------------
+
+class InlineDisplay:
+    """imshow + waitKey on the calling thread (macOS: HighGUI must stay on main)."""
+
+    def __init__(self, title):
+        self.title = title
+        self._quit = False
+
+    def show(self, frame) -> bool:
+        """Shows frame; returns False once 'q' was pressed."""
+        cv2.imshow(self.title, frame)
+        return not self.quit_requested()
+
+    def quit_requested(self) -> bool:
+        # also pumps GUI events, so the window stays responsive while a source stalls
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            self._quit = True
+        return self._quit
+
+    def stop(self):
+        cv2.destroyAllWindows()
+
+
+class ThreadedDisplay(threading.Thread):
+    """
+    Owns the HighGUI window on a daemon thread so imshow/waitKey (often
+    10-20 ms) overlap with inference. show() never blocks: it replaces any
+    frame the window has not drawn yet (1-slot queue).
+    """
+
+    def __init__(self, title):
+        super().__init__(daemon=True)
+        self.title = title
+        self._q = queue.Queue(maxsize=1)
+        self._quit = False
+        self._stopped = False
+        self.start()
+
+    def run(self):
+        while not self._stopped:
+            try:
+                cv2.imshow(self.title, self._q.get(timeout=0.05))
+            except queue.Empty:
+                pass
+            # keep pumping GUI events even when no new frame arrived
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                self._quit = True
+        cv2.destroyAllWindows()
+
+    def show(self, frame) -> bool:
+        """Queues frame for display; returns False once 'q' was pressed."""
+        try:
+            self._q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._q.put_nowait(frame)
+        except queue.Full:
+            pass
+        return not self._quit
+
+    def quit_requested(self) -> bool:
+        return self._quit
+
+    def stop(self):
+        self._stopped = True
+        self.join(timeout=1.0)
+
+
+def make_display(title):
+    if sys.platform == "darwin":
+        return InlineDisplay(title)
+    return ThreadedDisplay(title)
+
+
+# ------------------------- MOTION GATE ----------------------------
+
+class MotionGate:
+    """
+    Cheap static-scene check in front of YOLO.
+
+    Compares a 1/8-scale grayscale thumbnail against the last frame that was
+    sent to YOLO; if the mean absolute difference stays under `thresh`, the
+    previous detections are reused. A refresh is forced every `max_skip`
+    frames so slow changes are still picked up. thresh <= 0 disables it.
+
+    server.py mirrors this in DetectorWorker._is_static (YOLO_SKIP_STATIC /
+    YOLO_STATIC_MAX_SKIP); keep the two in step.
+    """
+
+    def __init__(self, thresh=0.0, max_skip=30):
+        self.thresh = thresh
+        self.max_skip = max_skip
+        self._ref = None
+        self._skipped = 0
+
+    def needs_detection(self, frame) -> bool:
+        if self.thresh <= 0:
+            return True
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (max(1, w // 8), max(1, h // 8)), interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if (
+            self._ref is not None
+            and self._ref.shape == small.shape
+            and self._skipped < self.max_skip
+            and cv2.absdiff(self._ref, small).mean() < self.thresh
+        ):
+            self._skipped += 1
+            return False
+        self._ref = small
+        self._skipped = 0
+        return True
 
 
 # ------------------------- MAIN LOOP ------------------------------
@@ -481,6 +716,45 @@ def main():
     parser.add_argument(
         "--device", default="cpu", help="cuda or cpu"
     )
+    parser.add_argument(
+        "--capture-backend",
+        choices=sorted(CAPTURE_BACKENDS),
+        default="auto",
+        help="OpenCV capture backend (ffmpeg/gstreamer for RTSP or HW decode)",
+    )
+    parser.add_argument(
+        "--half", action="store_true", help="FP16 inference (CUDA only)"
+    )
+    parser.add_argument(
+        "--export",
+        choices=["none", "engine", "onnx"],
+        default="none",
+        help="Run an exported copy of --weights (TensorRT engine / ONNX), cached next to the .pt",
+    )
+    parser.add_argument(
+        "--motion-thresh",
+        type=float,
+        default=0.0,
+        help="Skip YOLO when mean pixel change vs last detected frame is below this (0 = off, ~2 typical)",
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1,
+        help="Frames per YOLO call (>1 raises GPU throughput, adds batch/fps latency)",
+    )
+    parser.add_argument(
+        "--infer-every",
+        type=int,
+        default=1,
+        help="File sources: process every Nth frame; skipped frames are grab()bed, not decoded",
+    )
+    parser.add_argument(
+        "--display-width",
+        type=int,
+        default=0,
+        help="Downscale frames to this width before drawing/display (0 = full size, ~960 typical)",
+    )
     parser.add_argument(
         "--realtime",
         type=int,
@@ -515,15 +789,29 @@ def main():
     args = parser.parse_args()
 
     # Open video source
-    if args.source == "0":
-        cap = cv2.VideoCapture(0)
+    api = CAPTURE_BACKENDS[args.capture_backend]
+    # a bare index ("0", "1", ...) is a local camera (V4L2/DShow/MSMF)
+    camera = args.source.isdigit()
+    if camera:
+        cap = cv2.VideoCapture(int(args.source), api)
     else:
-        cap = cv2.VideoCapture(args.source)
+        cap = cv2.VideoCapture(args.source, api)
+    # webcams / RTSP / URLs are live; local files are replayed ("fake live")
+    live = camera or not os.path.isfile(args.source)
 
     if not cap.isOpened():
         print("Failed to open source:", args.source)
         return
 
+    if camera:
+        # MJPG keeps UVC webcams on a shallower (and cheaper to decode) pipeline
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        # driver default queues ~4 frames (>100 ms stale); keep only the newest.
+        # Only camera backends honour this; FFmpeg/GStreamer streams rely on
+        # FrameGrabber dropping to the newest frame instead.
+        if not cap.set(cv2.CAP_PROP_BUFFERSIZE, 1):
+            print("[WARN] Camera backend ignored CAP_PROP_BUFFERSIZE=1")
+
     # ATM ROI auto-detection from the first frame
     if args.camera_type == "ATM":
         ret0, frame0 = cap.read()
@@ -534,7 +822,7 @@ def main():
         print("[INFO] Auto-detected ATM_ROI:", ATM_ROI)
 
         # For file sources, rewind to start so we don't skip frames
-        if args.source != "0":
+        if not camera:
             cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
     # FPS for fake-live playback
@@ -543,12 +831,24 @@ def main():
         fps = 30.0
     frame_delay = 1.0 / fps
 
-    detector = Yolo10Detector(weights=args.weights, device=args.device)
+    detector = Yolo10Detector(
+        weights=args.weights,
+        device=args.device,
+        half=args.half,
+        export=args.export,
+        batch=args.batch,
+    )
     tracker = SimpleTracker()
+    motion_gate = MotionGate(thresh=args.motion_thresh)
+    last_detections = []
 
     # Load ML danger model if provided
     ml_model: Any = None
     if args.ml_model is not None:
+        try:
+            import joblib  # only needed (and only paid for) with --ml-model
+        except ImportError:
+            joblib = None
         if joblib is None:
             print("[WARN] joblib not installed; cannot load ML model.")
         elif os.path.exists(args.ml_model):
@@ -574,114 +874,163 @@ def main():
         f"camera_type={args.camera_type}, after_hours={is_after_hours()}"
     )
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    # Live sources: capture on a grabber thread so inference only sees the newest frame
+    grabber = FrameGrabber(cap) if live else None
+    if grabber is not None:
+        grabber.start()
+    # live sources already drop to the newest frame on the grabber thread
+    skip = 0 if live else max(1, args.infer_every) - 1
+
+    display = make_display("Bank CV Monitor")
+    # fake-live pacing: sleep to a per-frame deadline so processing time is not added on top
+    frame_period = frame_delay * (skip + 1)
+    next_due = time.monotonic()
+
+    done = False
+    while not done:
+        # Gather up to --batch frames so YOLO runs once per batch
+        batch = []
+        while len(batch) < max(1, args.batch):
+            if grabber is not None:
+                ret, frame = grabber.read(display.quit_requested)
+            else:
+                ret, frame = cap.read()
+            if not ret:
+                done = True
+                break
+            batch.append((frame, time.time()))
+            # skip *after* a processed frame so frame 0 is analysed; grab() only
+            # demuxes, the skipped frames are never decoded/converted
+            for _ in range(skip):
+                if not cap.grab():
+                    break
+        if not batch:
             break
 
-        ts = time.time()
+        # Detection (static frames reuse the previous detections)
+        run = [motion_gate.needs_detection(f) for f, _ in batch]
+        to_detect = [f for (f, _), r in zip(batch, run) if r]
+        fresh = iter(detector.detect_batch(to_detect) if to_detect else [])
 
-        # Detection
-        detections = detector.detect(frame)
+        for (frame, ts), r in zip(batch, run):
+            detections = next(fresh) if r else last_detections
+            last_detections = detections
 
-        # Tracking
-        tracks = tracker.update(detections, ts, args.camera_type)
-
-        # Build scene state
-        scene = SceneState(
-            timestamp=ts,
-            camera_type=args.camera_type,
-            tracks=tracks,
-        )
+            # Tracking
+            tracks = tracker.update(detections, ts, args.camera_type)
 
-        # Features
-        features = extract_features(scene)
-
-        if args.mode == "collect":
-            vec = features_to_vector(features)
-            csv_writer.writerow([args.label] + vec)
-
-            info_line = f"COLLECT label={args.label}"
-            cv2.putText(
-                frame,
-                info_line,
-                (20, 40),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1.0,
-                (0, 255, 255),
-                2,
+            # Build scene state
+            scene = SceneState(
+                timestamp=ts,
+                camera_type=args.camera_type,
+                tracks=tracks,
             )
 
-        else:
-            result = compute_danger_score(features)
-            danger_score = result["danger_score"]
-            labels = result["labels"]
-
-            # Optional ML fusion
-            if ml_model is not None:
-                vec = [features_to_vector(features)]
-                prob = float(ml_model.predict_proba(vec)[0][1])  # P(suspicious)
-                ml_score = int(100 * prob)
-                danger_score = int((danger_score + ml_score) / 2)
-                if prob > 0.6 and "ML_SUSPICIOUS" not in labels:
-                    labels.append("ML_SUSPICIOUS")
-
-            # --- Visualization / logging ---
-            for tr in tracks:
-                x1, y1, x2, y2 = map(int, tr.bbox)
-                color = (0, 255, 0)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                txt = f"{tr.class_name}#{tr.track_id}"
-                cv2.putText(
+            # Features
+            features = extract_features(scene)
+
+            # Draw on a display-sized copy; tracking/features keep source coords
+            draw_scale = 1.0
+            if 0 < args.display_width < frame.shape[1]:
+                draw_scale = args.display_width / frame.shape[1]
+                frame = cv2.resize(
                     frame,
-                    txt,
-                    (x1, max(0, y1 - 5)),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    color,
-                    1,
+                    (args.display_width, max(1, round(frame.shape[0] * draw_scale))),
+                    interpolation=cv2.INTER_AREA,
                 )
 
-            # Draw ROIs (kept commented as in your original)
-            """
-            if args.camera_type == "ATM":
-                x1, y1, x2, y2 = map(int, ATM_ROI)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 255, 0), 2)
-            elif args.camera_type == "PARKING":
-                x1, y1, x2, y2 = PARKING_ROI
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 255, 0), 2)
-            """
-
-            # Overlay danger score
-            info_line = f"DANGER: {danger_score:.0f}"
-            if labels:
-                info_line += " | " + ",".join(labels)
-            cv2.putText(
-                frame,
-                info_line,
-                (20, 40),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1.0,
-                (0, 0, 255) if danger_score >= 60 else (0, 255, 255),
-                2,
-            )
+            if args.mode == "collect":
+                vec = features_to_vector(features)
+                csv_writer.writerow([args.label] + vec)
 
-            if labels:
-                print(
-                    f"[ALERT] t={datetime.fromtimestamp(ts)} "
-                    f"score={danger_score} labels={labels}"
+                info_line = f"COLLECT label={args.label}"
+                cv2.putText(
+                    frame,
+                    info_line,
+                    (20, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0,
+                    (0, 255, 255),
+                    2,
                 )
 
-        cv2.imshow("Bank CV Monitor", frame)
-
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
-
-        if args.realtime and args.source != "0":
-            time.sleep(frame_delay)
+            else:
+                result = compute_danger_score(features)
+                danger_score = result["danger_score"]
+                labels = result["labels"]
+
+                # Optional ML fusion
+                if ml_model is not None:
+                    vec = [features_to_vector(features)]
+                    prob = float(ml_model.predict_proba(vec)[0][1])  # P(suspicious)
+                    ml_score = int(100 * prob)
+                    danger_score = int((danger_score + ml_score) / 2)
+                    if prob > 0.6 and "ML_SUSPICIOUS" not in labels:
+                        labels.append("ML_SUSPICIOUS")
+
+                # --- Visualization / logging ---
+                for tr in tracks:
+                    x1, y1, x2, y2 = (int(v * draw_scale) for v in tr.bbox)
+                    color = (0, 255, 0)
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                    txt = f"{tr.class_name}#{tr.track_id}"
+                    cv2.putText(
+                        frame,
+                        txt,
+                        (x1, max(0, y1 - 5)),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5,
+                        color,
+                        1,
+                    )
+
+                # Draw ROIs (kept commented as in your original)
+                """
+                if args.camera_type == "ATM":
+                    x1, y1, x2, y2 = map(int, ATM_ROI)
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 255, 0), 2)
+                elif args.camera_type == "PARKING":
+                    x1, y1, x2, y2 = PARKING_ROI
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 255, 0), 2)
+                """
+
+                # Overlay danger score
+                info_line = f"DANGER: {danger_score:.0f}"
+                if labels:
+                    info_line += " | " + ",".join(labels)
+                cv2.putText(
+                    frame,
+                    info_line,
+                    (20, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0,
+                    (0, 0, 255) if danger_score >= 60 else (0, 255, 255),
+                    2,
+                )
 
-    cap.release()
-    cv2.destroyAllWindows()
+                if labels:
+                    print(
+                        f"[ALERT] t={datetime.fromtimestamp(ts)} "
+                        f"score={danger_score} labels={labels}"
+                    )
+
+            if not display.show(frame):
+                done = True
+                break
+
+            if args.realtime and not live:
+                next_due += frame_period
+                lag = next_due - time.monotonic()
+                if lag > 0:
+                    time.sleep(lag)
+                else:
+                    next_due -= lag  # running behind; don't try to catch up in a burst
+
+    if grabber is not None:
+        grabber.stop()  # the grabber thread releases cap itself
+    else:
+        cap.release()
+    display.stop()
 
     if csv_file is not None:
         csv_file.close()
@@ -15,6 +15,8 @@ import argparse
 from typing import Optional, Dict, Any, List
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- auto-load .env if present ---
 try:
@@ -55,6 +57,20 @@ class NeuralSeekClient:
         else:
             self.enabled = bool(self.instance and self.api_key)
 
+        # Persistent session: keep-alive reuses the TCP+TLS connection across agent calls.
+        # Agent calls are not idempotent, so only retry when the request never ran:
+        # connect errors and 429/502/503 (with backoff). Read timeouts and 504 are not
+        # retried, which also keeps the worst case close to a single --timeout.
+        # Pool sized for a few concurrent agent calls from one client.
+        retry = Retry(total=3, connect=3, read=0, other=0, status=3, backoff_factor=0.3,
+                      status_forcelist=(429, 502, 503),
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update(self._headers())
+
     def _url(self) -> str:
         if self.endpoint:
             return self.endpoint
@@ -74,7 +90,7 @@ class NeuralSeekClient:
             payload["vars"] = vars_dict
         if input_text:
             payload["input"] = input_text
-        resp = requests.post(self._url(), headers=self._headers(), json=payload, timeout=self.timeout)
+        resp = self._session.post(self._url(), json=payload, timeout=self.timeout)
         resp.raise_for_status()
         try:
             return resp.json()
@@ -135,10 +151,11 @@ def run_neuralseek_governor(ns: NeuralSeekClient, event_payload: dict, policy: d
     ns_body = governor_raw.get("neuralseek") if isinstance(governor_raw, dict) else None
     if not ns_body and isinstance(governor_raw, dict):
         ns_body = governor_raw
+    ns_body = ns_body or {}
 
-    level = (ns_body or {}).get("escalation_level") or (ns_body or {}).get("level")
-    action = (ns_body or {}).get("action")
-    confidence = (ns_body or {}).get("confidence")
+    level = ns_body.get("escalation_level") or ns_body.get("level")
+    action = ns_body.get("action")
+    confidence = ns_body.get("confidence")
 
     result = {
         "escalation_level": level,
@@ -1,20 +1,22 @@
 # server.py — WebRTC sender with live YOLO overlays
 import asyncio
-import json
 import os
+import sys
+import threading
 import time
 from pathlib import Path
 from typing import Dict, Optional
 
 import cv2
 import numpy as np
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
 from fractions import Fraction
-from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack, RTCRtpSender
 from aiortc.contrib.media import MediaRelay
 from av import VideoFrame
 
@@ -33,6 +35,19 @@ WEBRTC_SHARED_SECRET = os.getenv("WEBRTC_SHARED_SECRET", "CHANGE_ME_SHARED_SECRE
 DEFAULT_SOURCE = int(os.getenv("VIDEO_SOURCE", "0"))     # camera index or RTSP/URL
 IMG_SIZE = int(os.getenv("IMG_SIZE", "640"))
 FPS = int(os.getenv("FPS", "30"))
+YOLO_STRIDE = max(1, int(os.getenv("YOLO_STRIDE", "1")))  # detect on every Nth captured frame
+# downscale captured frames so the longer side is at most this (0 = native); e.g. IMG_SIZE
+# makes detection, drawing, YUV conversion and encoding all run at inference resolution
+STREAM_MAX_SIDE = int(os.getenv("STREAM_MAX_SIDE", "0"))
+# skip YOLO while the scene is static: mean abs gray-level change of a
+# 1/STATIC_THUMB_DIV-scale thumbnail vs the last detected frame below this
+# (0 = off, 1-2 typical); boxes are still refreshed at least every
+# YOLO_STATIC_MAX_SKIP frames. Same check as MotionGate in danger_yolo_live.py
+# (defaults match its --motion-thresh/max_skip); kept as a copy because that
+# module hard-imports ultralytics and the CLI, while here YOLO stays optional.
+YOLO_SKIP_STATIC = float(os.getenv("YOLO_SKIP_STATIC", "0"))
+YOLO_STATIC_MAX_SKIP = int(os.getenv("YOLO_STATIC_MAX_SKIP", "30"))
+STATIC_THUMB_DIV = 8
 
 # resolve defaults relative to this backend module so they still work after repo restructuring
 DEFAULT_WEIGHTS = os.getenv(
@@ -46,6 +61,12 @@ ALERTS_JSONL_PATH = os.getenv(
 )
 MAX_ALERTS_RETURNED = int(os.getenv("MAX_ALERTS_RETURNED", "250"))
 YOLO_DEVICE = os.getenv("YOLO_DEVICE", None)  # "cpu", "mps", "cuda", or index
+# run an exported copy of .pt weights: "fp32" | "fp16" | "int8" (TensorRT engine on
+# CUDA, ONNX otherwise; cached next to the .pt). Empty = load the .pt as-is
+YOLO_PRECISION = os.getenv("YOLO_PRECISION", "").strip().lower()
+YOLO_INT8_DATA = os.getenv("YOLO_INT8_DATA", "coco8.yaml")  # int8 calibration dataset
+# preferred WebRTC video codec, e.g. "H264" (libx264) or "VP8"; empty = browser negotiation
+WEBRTC_VIDEO_CODEC = os.getenv("WEBRTC_VIDEO_CODEC", "").strip()
 
 # Danger label config
 DANGER_CONFIG = {
@@ -53,32 +74,90 @@ DANGER_CONFIG = {
     "MEDIUM": {"scissors"},
 }
 COLORS = {"LOW": (60, 180, 75), "MEDIUM": (0, 215, 255), "HIGH": (0, 0, 255)}
+# exact-label -> level table (HIGH wins if a label is listed twice)
+_LEVEL_BY_LABEL = {sys.intern(lbl): "MEDIUM" for lbl in DANGER_CONFIG["MEDIUM"]}
+_LEVEL_BY_LABEL.update({sys.intern(lbl): "HIGH" for lbl in DANGER_CONFIG["HIGH"]})
 
 def canonical(s: str) -> str:
     return s.strip().lower()
 
 def danger_level_for_label(name: str) -> str:
-    n = canonical(name)
-    if n in DANGER_CONFIG["HIGH"]:
-        return "HIGH"
-    if n in DANGER_CONFIG["MEDIUM"]:
-        return "MEDIUM"
-    return "LOW"
-
-def highest_danger_level(levels) -> str:
-    if "HIGH" in levels: return "HIGH"
-    if "MEDIUM" in levels: return "MEDIUM"
-    return "LOW"
+    # model class names are already canonical; only normalize on a miss
+    level = _LEVEL_BY_LABEL.get(name)
+    if level is None:
+        level = _LEVEL_BY_LABEL.get(canonical(name), "LOW")
+    return level
+
+LEVEL_NAMES = ("LOW", "MEDIUM", "HIGH")  # index == level id
+LEVEL_HIGH = LEVEL_NAMES.index("HIGH")
+LEVEL_COLORS = tuple(COLORS[n] for n in LEVEL_NAMES)  # level id -> BGR
+
+def build_level_lut(names) -> np.ndarray:
+    """class id -> level id table for a model's class names (dict or list)."""
+    items = list(names.items() if isinstance(names, dict) else enumerate(names))
+    lut = np.zeros(max((i for i, _ in items), default=-1) + 1, dtype=np.uint8)
+    for i, name in items:
+        lut[i] = LEVEL_NAMES.index(danger_level_for_label(str(name)))
+    return lut
+
+def build_name_list(names) -> list:
+    """class id -> label list for a model's class names (dict or list)."""
+    if not isinstance(names, dict):
+        return [str(n) for n in names]
+    return [str(names.get(i, i)) for i in range(max(names, default=-1) + 1)]
+
+_TINT_CACHE: Dict[tuple, np.ndarray] = {}
+
+def _tint_matrix(color, alpha) -> np.ndarray:
+    """3x4 cv2.transform matrix computing (1-alpha)*px + alpha*color per channel."""
+    key = (tuple(color), alpha)
+    m = _TINT_CACHE.get(key)
+    if m is None:
+        m = np.hstack([np.eye(3) * (1 - alpha), np.asarray(color, np.float64)[:, None] * alpha])
+        m = _TINT_CACHE[key] = m.astype(np.float32)
+    return m
+
+_BANNER_FONT, _BANNER_SCALE, _BANNER_THICK = cv2.FONT_HERSHEY_SIMPLEX, 1.5, 4
+_SPRITE_CACHE: Dict[str, tuple] = {}
+
+def _text_sprite(text):
+    """
+    Anti-aliased white-on-black coverage mask for `text`, rendered once.
+    Returns (mask_bgr, ascent_px); the banner strings are a tiny fixed set.
+    """
+    hit = _SPRITE_CACHE.get(text)
+    if hit is None:
+        (tw, th), base = cv2.getTextSize(text, _BANNER_FONT, _BANNER_SCALE, _BANNER_THICK)
+        pad = _BANNER_THICK
+        mask = np.zeros((th + base + 2 * pad, tw + 2 * pad, 3), dtype=np.uint8)
+        cv2.putText(mask, text, (pad, th + pad), _BANNER_FONT, _BANNER_SCALE,
+                    (255,255,255), _BANNER_THICK, cv2.LINE_AA)
+        hit = _SPRITE_CACHE[text] = (mask, th + pad)
+    return hit
+
+def _blit_white_text(frame, text, x, y):
+    """Same pixels as putText(..., white, LINE_AA) at baseline (x, y), via the cached mask."""
+    mask, ascent = _text_sprite(text)
+    fh, fw = frame.shape[:2]
+    x0, y0 = x - _BANNER_THICK, y - ascent
+    x1, y1 = min(x0 + mask.shape[1], fw), min(y0 + mask.shape[0], fh)
+    mx, my = max(0, -x0), max(0, -y0)
+    x0, y0 = max(0, x0), max(0, y0)
+    if x1 <= x0 or y1 <= y0:
+        return
+    roi = frame[y0:y1, x0:x1]
+    m = mask[my:my + (y1 - y0), mx:mx + (x1 - x0)]
+    # roi += (255 - roi) * coverage  -> alpha blend toward white, ROI only
+    cv2.add(roi, cv2.multiply(cv2.bitwise_not(roi), m, scale=1/255), dst=roi)
 
 def overlay_safe(frame, text, color=(0,0,255), alpha=0.35):
+    # frames only come from cap.retrieve() / the uint8 placeholders; no clip+cast copy
+    assert frame.dtype == np.uint8, frame.dtype
     try:
-        if frame.dtype != np.uint8:
-            frame = np.clip(frame, 0, 255).astype(np.uint8)
-        overlay = frame.copy(); overlay[:] = color
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
+        # single in-place pass: no solid frame-sized layer to allocate, fill or read
+        cv2.transform(frame, _tint_matrix(color, alpha), dst=frame)
         h, _ = frame.shape[:2]
-        cv2.putText(frame, text, (30, int(0.12*h)),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255,255,255), 4, cv2.LINE_AA)
+        _blit_white_text(frame, text, 30, int(0.12*h))
     except Exception:
         pass
     return frame
@@ -100,83 +179,375 @@ class PipelineState(BaseModel):
 state = PipelineState()
 
 # Global capture / model
-_cap = None
-_cap_lock = asyncio.Lock()
+_reader = None  # CameraReader while the pipeline is running
+_detector = None  # DetectorWorker while the pipeline is running
 
-_yolo = None
+# (yolo, level_lut, caption_prefix, predict_device), replaced as a whole by _load_model:
+# level_lut maps class id -> level id, caption_prefix class id -> "label [LEVEL]"
+_model = None
 _yolo_conf = DEFAULT_CONF
 _yolo_weights = DEFAULT_WEIGHTS
 _source = DEFAULT_SOURCE
 
 # ---------- helpers ----------
+_BLANK_CACHE: Dict[str, np.ndarray] = {}
+
+def _blank_for(reason: str) -> np.ndarray:
+    """Placeholder frame for when no camera image is available (rendered once per reason)."""
+    img = _BLANK_CACHE.get(reason)
+    if img is None:
+        h, w = 480, 640
+        img = np.zeros((h, w, 3), dtype=np.uint8)
+        cv2.putText(img, reason, (30, h // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (200, 200, 200), 2, cv2.LINE_AA)
+        img.flags.writeable = False  # shared across ticks/tracks; copy before drawing
+        _BLANK_CACHE[reason] = img
+    return img
+
+STATUS_TTL_SEC = 0.25
+_status_cache = {"t": 0.0, "v": None}  # reset by _start_capture/_stop_capture
+
 def _status_payload():
+    now = time.monotonic()
+    if _status_cache["v"] is not None and now - _status_cache["t"] < STATUS_TTL_SEC:
+        return _status_cache["v"]
     uptime = None
     if state.running and state.started_at:
         uptime = max(0.0, time.time() - state.started_at)
-    return {
+    payload = {
         "running": state.running,
         "uptime_sec": uptime,
         "pid": os.getpid(),
         "args": {"VIDEO_SOURCE": _source, "IMG_SIZE": IMG_SIZE, "FPS": FPS,
                  "YOLO_WEIGHTS": _yolo_weights, "YOLO_CONF": _yolo_conf},
     }
-
+    _status_cache["t"], _status_cache["v"] = now, payload
+    return payload
+
+
+ALERTS_TAIL_BLOCK = 64 * 1024
+_alerts_cache = {"key": None, "v": None}  # keyed on (mtime_ns, size, limit)
+
+def _tail_alerts(f, size: int, limit: int) -> list:
+    """Parses JSONL rows backwards from EOF in fixed blocks until `limit` rows are found."""
+    rows = []  # newest first
+    pos, head = size, b""
+    while pos > 0 and len(rows) < limit:
+        step = min(ALERTS_TAIL_BLOCK, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + head).split(b"\n")
+        head = lines.pop(0)  # possibly cut mid-line; completed by the next block
+        if pos == 0:
+            lines.insert(0, head)
+        for line in reversed(lines):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(orjson.loads(line))
+            except Exception:
+                continue
+            if len(rows) >= limit:
+                break
+    return rows
 
 def _read_alerts_from_file(limit: int = MAX_ALERTS_RETURNED):
-    if not os.path.exists(ALERTS_JSONL_PATH):
+    try:
+        st = os.stat(ALERTS_JSONL_PATH)
+    except OSError:
         return []
+    key = (st.st_mtime_ns, st.st_size, limit)
+    if _alerts_cache["key"] == key:  # /alerts is polled; file unchanged since last read
+        return _alerts_cache["v"]
     rows = []
     try:
-        with open(ALERTS_JSONL_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    rows.append(json.loads(line))
-                except Exception:
-                    continue
+        with open(ALERTS_JSONL_PATH, "rb") as f:
+            if limit and limit > 0:
+                rows = _tail_alerts(f, st.st_size, limit)
+            else:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rows.append(orjson.loads(line))
+                    except Exception:
+                        continue
+                rows.reverse()
     except Exception as e:
         print(f"[WARN] Failed to read alerts JSONL: {e}")
         return []
-    if limit and limit > 0:
-        rows = rows[-limit:]
-    return list(reversed(rows))
+    _alerts_cache["key"], _alerts_cache["v"] = key, rows
+    return rows
+
+def _exported_weights(weights: str) -> str:
+    """Path of the YOLO_PRECISION export of `weights`, exporting once; falls back to weights."""
+    if YOLO_PRECISION not in ("fp32", "fp16", "int8") or not weights.endswith(".pt"):
+        return weights
+    try:
+        import torch
+        cuda = torch.cuda.is_available()
+    except Exception:
+        cuda = False
+    fmt = "engine" if cuda else "onnx"
+    precision = YOLO_PRECISION
+    if not cuda and precision != "fp32":
+        print(f"[WARN] {precision} export needs CUDA; exporting fp32 ONNX instead.")
+        precision = "fp32"
+    # cache name reflects what was actually built, not what was asked for
+    target = f"{os.path.splitext(weights)[0]}.{precision}.{fmt}"
+    if os.path.exists(target):
+        return target
+    try:
+        print(f"[INFO] Exporting {weights} -> {target} (one-time)")
+        out = YOLO(weights).export(
+            format=fmt, imgsz=IMG_SIZE,
+            half=(precision == "fp16"),
+            int8=(precision == "int8"),
+            data=YOLO_INT8_DATA if precision == "int8" else None,
+            device=0 if cuda else "cpu",
+        )
+        os.replace(out, target)
+        return target
+    except Exception as e:
+        print(f"[WARN] YOLO {fmt} export failed ({e}); using {weights}")
+        return weights
 
 def _load_model(weights: str):
-    global _yolo
+    global _model
     if YOLO is None:
         print("[WARN] ultralytics not installed; skipping model load.")
-        _yolo = None
+        _model = None
         return
-    if (_yolo is None) or (weights != _yolo_weights):
-        print(f"[INFO] Loading YOLO weights: {weights}")
-        _yolo = YOLO(weights)
-        if YOLO_DEVICE:
+    if (_model is None) or (weights != _yolo_weights):
+        path = _exported_weights(weights)
+        print(f"[INFO] Loading YOLO weights: {path}")
+        yolo = YOLO(path)
+        level_lut = build_level_lut(yolo.names)
+        name_list = build_name_list(yolo.names)
+        # a class's level is fixed per model, so the caption up to the confidence is too
+        caption_prefix = [f"{name} [{LEVEL_NAMES[lvl]}]"
+                          for name, lvl in zip(name_list, level_lut.tolist())]
+        predict_device = None
+        if YOLO_DEVICE and path == weights:
             try:
-                _yolo.to(YOLO_DEVICE)
+                yolo.to(YOLO_DEVICE)
             except Exception as e:
                 print(f"[WARN] Could not move model to {YOLO_DEVICE}: {e}")
+        elif YOLO_DEVICE:
+            predict_device = YOLO_DEVICE  # exported models can't .to(); select at predict
+        # publish in one store so the detector never pairs a new model with an old LUT
+        _model = (yolo, level_lut, caption_prefix, predict_device)
+
+def _fit_max_side(img, max_side: int):
+    """Downscale img so max(h, w) <= max_side, keeping even dims for yuv420p."""
+    h, w = img.shape[:2]
+    r = max_side / max(h, w)
+    if r >= 1.0:
+        return img
+    size = (max(2, int(w * r) & ~1), max(2, int(h * r) & ~1))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+class CameraReader(threading.Thread):
+    """Owns the VideoCapture and publishes the newest frame.
+
+    Single producer (this thread) / single consumer (the video track): the frame is
+    published as one `(seq, img)` tuple reference, which is an atomic store under the
+    GIL, so the consumer never needs a lock. `img` is None after a failed read.
+    """
+    def __init__(self, cap, paced: bool):
+        super().__init__(daemon=True)
+        self._cap = cap
+        self._paced = paced  # file sources: play back at FPS instead of decode speed
+        self._stop_evt = threading.Event()
+        self.new_frame = threading.Event()  # set on every publish (wakes the detector)
+        self.latest = (0, None)
+
+    def run(self):
+        seq = 0
+        period = 1 / FPS
+        next_t = time.monotonic()
+        try:
+            while not self._stop_evt.is_set():
+                # grab() only dequeues; a live source delivering faster than FPS has its
+                # extra frames dropped here without paying for decode/convert in retrieve()
+                ok = self._cap.grab()
+                if ok and not self._paced:
+                    now = time.monotonic()
+                    if now < next_t - period / 4:
+                        continue
+                    next_t = max(next_t + period, now - period)
+                ok, img = self._cap.retrieve() if ok else (False, None)
+                if ok and STREAM_MAX_SIDE > 0:
+                    img = _fit_max_side(img, STREAM_MAX_SIDE)
+                seq += 1
+                self.latest = (seq, img if ok else None)
+                self.new_frame.set()
+                if self._paced or not ok:
+                    next_t += period
+                    delay = next_t - time.monotonic()
+                    if delay > 0:
+                        self._stop_evt.wait(delay)
+                    else:
+                        next_t = time.monotonic()
+        finally:
+            try: self._cap.release()
+            except Exception: pass
+
+    def stop(self):
+        self._stop_evt.set()
+        self.join(timeout=2.0)
+
+def _draw_detections(img, dets):
+    """Draws a DetectorWorker result `(seq, boxes, level_id, err)` onto img in place."""
+    _, boxes, frame_level_id, err = dets
+    for p1, p2, color, caption in boxes:
+        cv2.rectangle(img, p1, p2, color, 2)
+        cv2.putText(img, caption, (p1[0], max(0, p1[1] - 8)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2, cv2.LINE_AA)
+    if err:
+        # tiny hint if inference failed (keeps stream alive)
+        cv2.putText(img, err, (10, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,0,255), 2, cv2.LINE_AA)
+    if frame_level_id == LEVEL_HIGH:
+        img = overlay_safe(img, "DANGEROUS OBJECT DETECTED", color=COLORS["HIGH"], alpha=0.35)
+    return img
+
+class DetectorWorker(threading.Thread):
+    """Runs YOLO off the event loop on the newest captured frame.
+
+    Publishes only the detections, as one `(seq, boxes, level_id, err)` tuple (same
+    lock-free swap as CameraReader); the video track draws the latest result onto
+    every captured frame. Frames arriving mid-predict are skipped, and YOLO_STRIDE
+    thins detection further, so stream fps is bounded by capture, not by the model.
+    """
+    def __init__(self, reader: "CameraReader"):
+        super().__init__(daemon=True)
+        self._reader = reader
+        self._stop_evt = threading.Event()
+        self._infer_buf = None  # reused contiguous BGR input for YOLO
+        self._static_ref = None  # gray thumbnail of the last detected frame
+        self._static_skipped = 0
+        self.latest = (0, (), 0, None)
+
+    def run(self):
+        last_seq = -YOLO_STRIDE
+        while not self._stop_evt.is_set():
+            if not self._reader.new_frame.wait(0.5):
+                continue
+            self._reader.new_frame.clear()
+            seq, img = self._reader.latest
+            if img is None or seq - last_seq < YOLO_STRIDE:
+                continue
+            last_seq = seq
+            if YOLO_SKIP_STATIC > 0 and self._is_static(img):
+                continue  # keep publishing the previous boxes
+            self.latest = (seq,) + self._detect(img)
+
+    def _is_static(self, img) -> bool:
+        h, w = img.shape[:2]
+        small = cv2.resize(
+            img,
+            (max(1, w // STATIC_THUMB_DIV), max(1, h // STATIC_THUMB_DIV)),
+            interpolation=cv2.INTER_AREA,
+        )
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        ref = self._static_ref
+        if (ref is not None and ref.shape == small.shape
+                and self._static_skipped < YOLO_STATIC_MAX_SKIP
+                and cv2.absdiff(ref, small).mean() < YOLO_SKIP_STATIC):
+            self._static_skipped += 1
+            return True
+        self._static_ref, self._static_skipped = small, 0
+        return False
+
+    def stop(self):
+        self._stop_evt.set()
+        self.join(timeout=2.0)
+
+    def _infer_input(self, img):
+        """Letterbox img into a reused, stride-aligned buffer so YOLO's own letterbox is a no-op.
+
+        The aspect ratio is kept; the remainder up to the next multiple of 32 is gray
+        (114, as in Ultralytics) padding on the bottom/right, so box coords need no
+        offset. Returns (input, sx, sy) where sx/sy map input coords back to img coords.
+        """
+        h, w = img.shape[:2]
+        r = IMG_SIZE / max(h, w)
+        if r >= 1.0:
+            return img, 1.0, 1.0
+        nw, nh = max(1, round(w * r)), max(1, round(h * r))
+        pw, ph = -(-nw // 32) * 32, -(-nh // 32) * 32
+        buf = self._infer_buf
+        if buf is None or buf.shape[:2] != (ph, pw):
+            buf = self._infer_buf = np.full((ph, pw, 3), 114, dtype=np.uint8)
+        # resize straight into the top-left ROI; the padding is written once at allocation
+        cv2.resize(img, (nw, nh), dst=buf[:nh, :nw], interpolation=cv2.INTER_LINEAR)
+        return buf, w / nw, h / nh
+
+    def _detect(self, img):
+        """Returns (boxes, frame_level_id, err); boxes are ((x1,y1), (x2,y2), color, caption)."""
+        model = _model  # one consistent (yolo, lut, captions, device) snapshot
+        if model is None:
+            return (), 0, None
+        yolo, level_lut, prefix, predict_device = model
+        try:
+            # run fast inference (no verbose)
+            inp, sx, sy = self._infer_input(img)
+            res = yolo.predict(inp, imgsz=IMG_SIZE, conf=_yolo_conf, device=predict_device,
+                               verbose=False)[0]
+            boxes = res.boxes
+            if boxes is None or len(boxes) == 0:
+                return (), 0, None
+            # one device->host transfer per frame instead of one per box
+            cls_arr = boxes.cls.cpu().numpy().astype(np.int32)
+            conf_arr = boxes.conf.cpu().numpy() if boxes.conf is not None else np.zeros(len(cls_arr))
+            xyxy_arr = (boxes.xyxy.cpu().numpy() * (sx, sy, sx, sy)).astype(np.int32)
+            level_ids = level_lut[cls_arr]  # classify every box in one gather
+            out = []
+            for cls_id, pct, (x1, y1, x2, y2), level_id in zip(
+                    cls_arr.tolist(), (conf_arr * 100).astype(np.int32).tolist(),
+                    xyxy_arr.tolist(), level_ids.tolist()):
+                out.append(((x1, y1), (x2, y2), LEVEL_COLORS[level_id], f"{prefix[cls_id]} {pct}%"))
+            return tuple(out), int(level_ids.max()), None
+        except Exception as e:
+            return (), 0, f"YOLO error: {type(e).__name__}"
 
 def _start_capture(source):
-    global _cap, state, _source
+    global _reader, _detector, state, _source
+    _status_cache["v"] = None
     if state.running:
         return
     _source = source
-    _cap = cv2.VideoCapture(source)
-    if not _cap.isOpened():
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        cap.release()
         raise RuntimeError(f"Unable to open video source: {source}")
-    try: _cap.set(cv2.CAP_PROP_FPS, FPS)
+    try: cap.set(cv2.CAP_PROP_FPS, FPS)
     except Exception: pass
+    paced = isinstance(source, str) and os.path.isfile(source)
+    if not paced:
+        # webcams/RTSP queue several frames by default; keep only the newest
+        try: cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception: pass
+    _reader = CameraReader(cap, paced=paced)
+    _reader.start()
+    _detector = DetectorWorker(_reader)
+    _detector.start()
     state.running = True
     state.started_at = time.time()
 
 def _stop_capture():
-    global _cap, state
-    if _cap is not None:
-        try: _cap.release()
+    global _reader, _detector, state
+    _status_cache["v"] = None
+    if _detector is not None:
+        try: _detector.stop()
+        except: pass
+        _detector = None
+    if _reader is not None:
+        try: _reader.stop()
         except: pass
-        _cap = None
+        _reader = None
     state.running = False
 
 # ---------- request bodies ----------
@@ -192,59 +563,74 @@ class VideoTrack(MediaStreamTrack):
         super().__init__()
         self._ts = 0
         self._time_base = Fraction(1, FPS)
+        self._last_latest = None  # reader.latest tuple that _last_img was built from
+        self._last_dets = None  # detector.latest tuple drawn onto _last_img
+        self._last_img = None
+        self._yuv = None  # reused I420 buffer; from_ndarray copies it into the frame
 
     async def recv(self):
         await asyncio.sleep(1 / FPS)
 
-        async with _cap_lock:
-            if not state.running or _cap is None:
-                h, w = 480, 640
-                img = np.zeros((h, w, 3), dtype=np.uint8)
+        # lock-free reads of the newest frame and the newest detections; inference
+        # never runs on the event loop. Every captured frame is streamed with the
+        # last known boxes; if neither changed since the last tick, re-send the image
+        reader, detector = _reader, _detector
+        running = state.running and reader is not None and detector is not None
+        latest = reader.latest if running else None
+        dets = detector.latest if running else None
+        if self._last_img is None or latest is not self._last_latest or dets is not self._last_dets:
+            if latest is None or latest[0] == 0:
+                img = _blank_for("No Signal")
+            elif latest[1] is None:
+                img = _blank_for("Read Error")
+            elif dets[1] or dets[3]:
+                # the detector may still be reading this frame; draw on a copy
+                img = _draw_detections(latest[1].copy(), dets)
             else:
-                ok, img = _cap.read()
-                if not ok or img is None:
-                    h, w = 480, 640
-                    img = np.zeros((h, w, 3), dtype=np.uint8)
-
-        # ----- YOLO inference & drawing -----
-        hazards = []
-        if _yolo is not None:
-            try:
-                # run fast inference (no verbose)
-                res = _yolo.predict(img, imgsz=IMG_SIZE, conf=_yolo_conf, verbose=False)[0]
-                names = res.names if hasattr(res, "names") else {}
-                if res.boxes is not None and len(res.boxes) > 0:
-                    for box in res.boxes:
-                        cls_id = int(box.cls.item())
-                        label = names.get(cls_id, str(cls_id)) if isinstance(names, dict) else str(cls_id)
-                        conf = float(box.conf.item()) if box.conf is not None else 0.0
-                        x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                        level = danger_level_for_label(label)
-                        hazards.append(level)
-                        color = COLORS[level]
-                        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-                        caption = f"{label} {conf:.2f} [{level}]"
-                        cv2.putText(img, caption, (x1, max(0, y1 - 8)),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2, cv2.LINE_AA)
-            except Exception as e:
-                # draw a tiny hint if inference failed (keeps stream alive)
-                cv2.putText(img, f"YOLO error: {type(e).__name__}",
-                            (10, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,0,255), 2, cv2.LINE_AA)
-
-        frame_level = highest_danger_level(hazards)
-        if frame_level == "HIGH":
-            img = overlay_safe(img, "DANGEROUS OBJECT DETECTED", color=COLORS["HIGH"], alpha=0.35)
-
-        # convert to AV frame with timestamps
-        frame = VideoFrame.from_ndarray(img, format="bgr24")
+                img = latest[1]
+            self._last_img = img
+            self._last_latest, self._last_dets = latest, dets
+        img = self._last_img
+
+        # convert to AV frame with timestamps; hand the encoder yuv420p directly so
+        # the BGR->YUV conversion happens once here (SIMD) instead of per encoder
+        h, w = img.shape[:2]
+        if h % 2 == 0 and w % 2 == 0:
+            yuv = self._yuv
+            if yuv is None or yuv.shape != (h * 3 // 2, w):
+                yuv = self._yuv = np.empty((h * 3 // 2, w), dtype=np.uint8)
+            cv2.cvtColor(img, cv2.COLOR_BGR2YUV_I420, dst=yuv)
+            frame = VideoFrame.from_ndarray(yuv, format="yuv420p")
+        else:
+            frame = VideoFrame.from_ndarray(img, format="bgr24")
         frame.pts = self._ts
         frame.time_base = self._time_base
         self._ts += 1
         return frame
 
-# Room -> { "pc": RTCPeerConnection, "track": VideoTrack }
+# Room -> { "pc": RTCPeerConnection, "track": relayed VideoTrack }
 rooms: Dict[str, dict] = {}
 
+# Single source track for the camera; every viewer gets a relay subscription,
+# so frame conversion runs once per tick regardless of how many viewers are open.
+_camera_track: Optional[VideoTrack] = None
+
+def _get_camera_track() -> VideoTrack:
+    global _camera_track
+    if _camera_track is None or _camera_track.readyState != "live":
+        _camera_track = VideoTrack()
+    return _camera_track
+
+def _prefer_codec(pc: RTCPeerConnection, sender, mime: str):
+    codecs = [c for c in RTCRtpSender.getCapabilities("video").codecs
+              if c.mimeType.lower() == mime.lower()]
+    if not codecs:
+        print(f"[WARN] WebRTC codec {mime} not supported; using default negotiation.")
+        return
+    for t in pc.getTransceivers():
+        if t.sender == sender:
+            t.setCodecPreferences(codecs)
+
 async def create_or_get_publisher(room: str):
     if not state.running:
         _start_capture(_source)
@@ -253,8 +639,12 @@ async def create_or_get_publisher(room: str):
         return rooms[room]["pc"]
 
     pc = RTCPeerConnection()
-    track = VideoTrack()
-    pc.addTrack(track)
+    # unbuffered: a slow encoder/viewer only ever gets the newest frame instead of
+    # growing its own per-subscriber queue (latency + memory) without bound
+    track = relay.subscribe(_get_camera_track(), buffered=False)
+    sender = pc.addTrack(track)
+    if WEBRTC_VIDEO_CODEC:
+        _prefer_codec(pc, sender, f"video/{WEBRTC_VIDEO_CODEC}")
 
     rooms[room] = {"pc": pc, "track": track}
 
@@ -305,14 +695,23 @@ def api_pipeline_status():
 @app.get("/alerts")
 def api_alerts(limit: int = MAX_ALERTS_RETURNED):
     data = _read_alerts_from_file(limit)
-    return JSONResponse(data, headers={"Cache-Control": "no-store"})
+    return Response(orjson.dumps(data), media_type="application/json",
+                    headers={"Cache-Control": "no-store"})
+
 
+ALERTS_STREAM_BATCH = 64  # rows per body chunk (one ASGI send each)
 
 @app.get("/alerts.jsonl")
 def api_alerts_file(limit: int = MAX_ALERTS_RETURNED):
     data = _read_alerts_from_file(limit)
-    body = "\n".join(json.dumps(item, ensure_ascii=False) for item in data)
-    return PlainTextResponse(body, headers={"Cache-Control": "no-store"})
+
+    # async generator: runs on the loop, no threadpool hop per chunk as with a sync one
+    async def _lines():
+        for i in range(0, len(data), ALERTS_STREAM_BATCH):
+            yield b"".join(orjson.dumps(item) + b"\n" for item in data[i:i + ALERTS_STREAM_BATCH])
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-store"})
 
 # Friendly aliases used by your page
 @app.post("/start")
@@ -328,7 +727,7 @@ async def ws_signaling(ws: WebSocket):
     await ws.accept()
     try:
         reg = await ws.receive_text()
-        msg = json.loads(reg)
+        msg = orjson.loads(reg)
         if msg.get("type") != "register" or msg.get("role") != "viewer":
             await ws.close(); return
         if msg.get("token") != WEBRTC_SHARED_SECRET:
@@ -339,15 +738,20 @@ async def ws_signaling(ws: WebSocket):
         offer = await pc.createOffer()
         await pc.setLocalDescription(offer)
         await _await_ice_complete(pc)
-        await ws.send_json({"type": "offer", "room": room, "sdp": pc.localDescription.sdp})
+        # text frame: the viewer JSON.parse()s event.data, which must not be a Blob
+        await ws.send_text(orjson.dumps(
+            {"type": "offer", "room": room, "sdp": pc.localDescription.sdp}).decode())
 
+        # viewers also trickle ice-candidate messages we ignore; only parse frames
+        # that can be an answer for this room (cheap substring prefilter)
+        room_tok = orjson.dumps(room).decode()
         while True:
             data = await ws.receive_text()
-            m = json.loads(data)
-            if m.get("room") != room: continue
-            if m.get("type") == "answer":
-                answer = RTCSessionDescription(sdp=m["sdp"], type="answer")
-                await pc.setRemoteDescription(answer)
+            if '"answer"' not in data or room_tok not in data: continue
+            m = orjson.loads(data)
+            if m.get("room") != room or m.get("type") != "answer": continue
+            answer = RTCSessionDescription(sdp=m["sdp"], type="answer")
+            await pc.setRemoteDescription(answer)
     except WebSocketDisconnect:
         pass
     except Exception:
@@ -357,12 +761,34 @@ async def ws_signaling(ws: WebSocket):
         except: pass
 
 async def _await_ice_complete(pc: RTCPeerConnection, timeout=3.0):
-    done = asyncio.get_event_loop().create_future()
+    if pc.iceGatheringState == "complete":
+        return
+    done = asyncio.Event()
     @pc.on("icegatheringstatechange")
     def _on_igs():
-        if pc.iceGatheringState == "complete" and not done.done():
-            done.set_result(True)
+        if pc.iceGatheringState == "complete":
+            done.set()
     try:
-        await asyncio.wait_for(done, timeout=timeout)
+        await asyncio.wait_for(done.wait(), timeout=timeout)
     except asyncio.TimeoutError:
         pass
+    finally:
+        # don't let handlers pile up across renegotiations
+        try: pc.remove_listener("icegatheringstatechange", _on_igs)
+        except Exception: pass
+
+
+if __name__ == "__main__":
+    import uvicorn
+    # Ask for uvloop (libuv C event loop; shipped by uvicorn[standard] off Windows)
+    # explicitly so a missing install is reported instead of silently using asyncio.
+    # The loop must be chosen here (or via `uvicorn --loop uvloop`): uvicorn creates
+    # it before importing the app, so setting a policy at import time is too late.
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        print("[WARN] uvloop not installed; using the stock asyncio event loop.")
+        loop = "asyncio"
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")),
+                loop=loop)